@@ -4,23 +4,41 @@ Steam Sales Bot - Telegram Bot pour notifier les jeux Steam gratuits
 Vérifie uniquement les vraies promotions -100% (pas les jeux F2P de base)
 """
 
-import json
+import errno
+import functools
+import gzip
+import hashlib
 import os
+import re
 import logging
-import requests
+import secrets
+import signal
 import asyncio
-import threading
+import sqlite3
+import time
 from datetime import datetime
-from typing import Dict, List, Set
-from http.server import HTTPServer, BaseHTTPRequestHandler
+from zoneinfo import ZoneInfo
+from typing import Dict, List, Optional, Set, Tuple
 from string import Template
 
-import pytz
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+import aiohttp
+from aiohttp import web
+import orjson
+from aiolimiter import AsyncLimiter
+import rcssmin
+import rjsmin
+from telegram import Bot, Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.error import Forbidden, RetryAfter
 from telegram.ext import Application, CommandHandler, CallbackQueryHandler, ContextTypes
-from apscheduler.schedulers.background import BackgroundScheduler
+from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.cron import CronTrigger
 
+try:
+    # Boucle libuv plus rapide pour les E/S réseau ; absente sous Windows
+    import uvloop
+except ImportError:
+    uvloop = None
+
 # Configuration du logging
 logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
@@ -37,215 +55,498 @@ if not TELEGRAM_TOKEN:
     exit(1)
     
 STEAM_API_URL = "https://store.steampowered.com/api/featured/"
+STEAM_API_TIMEOUT = 30
+# Une connexion qui ne s'établit pas vite échoue tôt et laisse place à une nouvelle tentative
+STEAM_API_CONNECT_TIMEOUT = 3.05
+# Tentatives par requête Steam et délai initial (secondes) entre elles, doublé à chaque échec
+STEAM_API_ATTEMPTS = 3
+STEAM_API_RETRY_BACKOFF = 0.5
+# Erreurs passagères de l'API Steam : réseau, délai dépassé ou corps tronqué/non JSON
+STEAM_API_ERRORS = (aiohttp.ClientError, asyncio.TimeoutError, orjson.JSONDecodeError)
+# Durée (secondes) pendant laquelle une réponse Steam est réutilisée sans nouvelle requête
+STEAM_CACHE_TTL = 300
+# Connexions simultanées et durée du cache DNS (secondes) de la session HTTP partagée
+HTTP_POOL_SIZE = 50
+DNS_CACHE_TTL = 300
+HTTP_USER_AGENT = "SteamSalesBot/1.0"
+# Envois Telegram simultanés maximum
+SEND_CONCURRENCY = 25
+# Débit d'envoi maximum (messages/seconde), juste sous la limite globale de Telegram (30/s)
+SEND_RATE_LIMIT = 29
+# Tentatives d'envoi d'un message quand Telegram répond RetryAfter (flood control)
+SEND_ATTEMPTS = 3
+DATABASE_FILE = "sent_games.db"
+DB_SCHEMA_VERSION = 1
+# Durée de conservation de l'historique des jeux envoyés
+SENT_GAMES_RETENTION_DAYS = 90
+# Jeux F2P connus à exclure (CS2, TF2, Dota 2, etc.)
+KNOWN_F2P_APP_IDS = frozenset({
+    730, 440, 570, 238960, 386360, 444090,
+    578080, 1222670, 359550, 252490
+})
+# Ancien format de stockage, importé automatiquement au premier démarrage
 SENT_GAMES_FILE = "sent_games.json"
-TIMEZONE = pytz.timezone('Europe/Paris')
+TIMEZONE = ZoneInfo('Europe/Paris')
 
 # Constantes
 CONTENT_TYPE_JSON = 'application/json'
 CONTENT_TYPE_HTML = 'text/html'
+CONTENT_TYPE_CSS = 'text/css'
+CONTENT_TYPE_JS = 'application/javascript'
 PORT = int(os.getenv('PORT', 8000))
+# STARTUP_CHECK=1 : lancer une vérification des promotions dès le démarrage
+STARTUP_CHECK = os.getenv('STARTUP_CHECK') == '1'
+# File d'attente des connexions entrantes du serveur HTTP (128 par défaut avec aiohttp)
+WEB_BACKLOG = 2048
+# URL publique du service (ex. https://steamsalesbot.onrender.com) : active le mode webhook
+WEBHOOK_URL = os.getenv('WEBHOOK_URL', '').rstrip('/')
+WEBHOOK_PATH = '/webhook'
+# Secret régénéré à chaque démarrage et transmis à Telegram avec set_webhook
+WEBHOOK_SECRET = secrets.token_urlsafe(32)
+TELEGRAM_APP_KEY = web.AppKey('telegram_application', Application)
+# Réponse /health pré-sérialisée : seuls l'horodatage et le nombre d'inscrits changent
+HEALTH_TEMPLATE = (b'{"status":"healthy","service":"Steam Sales Bot","timestamp":"%s",'
+                   b'"scheduled_checks":"9:00 and 19:00 Europe/Paris","total_users":%d}')
+
+# Modèles des messages de notification (str.format)
+SINGLE_GAME_TEMPLATE = ("🎮 **Nouvelle promotion -100% sur Steam !**\n\n"
+                        "🎯 **{name}**\n"
+                        "💰 Temporairement gratuit (normalement ${initial_price:.2f})\n"
+                        "🔗 [Obtenir le jeu maintenant]({url})\n\n"
+                        "⚡ **Promotion limitée dans le temps !**")
+MULTI_GAMES_HEADER = "🎮 **{count} nouvelles promotions -100% sur Steam !**\n\n"
+MULTI_GAMES_LINE = ("🎯 **{name}**\n"
+                    "💰 Temporairement gratuit (normalement ${initial_price:.2f})\n"
+                    "🔗 [Obtenir maintenant]({url})\n\n")
+MULTI_GAMES_FOOTER = "⚡ **Promotions limitées dans le temps !**"
+WELCOME_TEMPLATE = """🎉 **Bienvenue sur Steam Sales Bot !**
+
+✅ **Inscription confirmée !**
+🆔 **Votre Chat ID :** `{chat_id}`
+👥 **Vous rejoignez {total_users} gamers inscrits**
+
+🎮 **Ce que vous allez recevoir :**
+• Notifications instantanées des jeux Steam en vraie promotion -100%
+• Exclusion des jeux gratuits de base (pas de spam)
+• Liens directs vers Steam pour télécharger immédiatement
+• Vérifications automatiques à 9h et 19h (Europe/Paris)
+
+🔔 **Prochaines notifications :**
+• **Automatiques** : 9h00 et 19h00 tous les jours
+• **À la demande** : Utilisez la commande /check quand vous voulez
+
+⚡ **Important :** Je ne notifie que les **vraies promotions temporaires**, pas les jeux free-to-play permanents comme CS2, TF2, Dota 2, etc.
+
+🎯 **Bon gaming et n'hésitez pas à partager le bot !**
+
+_Vous pouvez utiliser /check à tout moment pour vérifier manuellement._"""
 
 TEMPLATE_DIR = os.path.join(os.path.dirname(__file__), "templates")
 
 
-def render_template(name, **context):
-    path = os.path.join(TEMPLATE_DIR, name)
-    with open(path, "r", encoding="utf-8") as f:
-        template = Template(f.read())
-    return template.safe_substitute(**context)
+STYLE_BLOCK = re.compile(r"<style>(.*?)</style>", re.S)
+SCRIPT_BLOCK = re.compile(r"<script>(.*?)</script>", re.S)
+STATIC_PREFIX = "/static/"
+STATIC_CACHE_CONTROL = "public, max-age=31536000, immutable"
+# CSS et JS extraits des pages : nom versionné -> (corps, corps gzip, ETag, ETag gzip, type de contenu)
+STATIC_ASSETS: Dict[str, Tuple[bytes, bytes, str, str, str]] = {}
 
 
-# Serveur HTTP minimal pour Render
-class HealthCheckHandler(BaseHTTPRequestHandler):
-    def do_GET(self):
-        if self.path == '/health':
-            self.send_response(200)
-            self.send_header('Content-type', CONTENT_TYPE_JSON)
-            self.end_headers()
-            
-            status = {
-                "status": "healthy",
-                "service": "Steam Sales Bot",
-                "timestamp": datetime.now(TIMEZONE).isoformat(),
-                "scheduled_checks": "9:00 and 19:00 Europe/Paris",
-                "total_users": len(steam_bot.chat_ids) if 'steam_bot' in globals() else 0
-            }
-            self.wfile.write(json.dumps(status, indent=2).encode())
-            
-        elif self.path.startswith('/subscribe/'):
-            # Endpoint d'inscription: /subscribe/CHAT_ID
-            try:
-                chat_id = int(self.path.split('/')[-1])
-                
-                # Ajouter le chat_id à la liste
-                if 'steam_bot' in globals():
-                    steam_bot.add_chat_id(chat_id)
-                    
-                self.send_response(200)
-                self.send_header('Content-type', CONTENT_TYPE_HTML)
-                self.end_headers()
-                
-                html = render_template('success.html', chat_id=chat_id, total_users=len(steam_bot.chat_ids) if 'steam_bot' in globals() else 0)
-                self.wfile.write(html.encode())
-                
-                logger.info(f"✅ Nouvel utilisateur inscrit: {chat_id}")
-                
-            except (ValueError, IndexError):
-                self.send_response(400)
-                self.send_header('Content-type', CONTENT_TYPE_HTML)
-                self.end_headers()
-                self.wfile.write(b"<h1>Erreur: Chat ID invalide</h1><p><a href='/'>Retour</a></p>")
-        
-        else:
-            self.send_response(200)
-            self.send_header('Content-type', CONTENT_TYPE_HTML)
-            self.end_headers()
-            
-            html = render_template('index.html', total_users=len(steam_bot.chat_ids) if 'steam_bot' in globals() else 0, last_update=datetime.now(TIMEZONE).strftime('%H:%M'))
-            self.wfile.write(html.encode())
+def content_etags(body: bytes) -> Tuple[str, str]:
+    """ETags forts d'un corps et de sa version gzip : deux représentations, deux validateurs"""
+    digest = hashlib.sha1(body).hexdigest()
+    return f'"{digest}"', f'"{digest}-gz"'
+
+
+def add_static_asset(stem: str, ext: str, content_type: str, text: str) -> str:
+    """Enregistre un fichier statique nommé d'après son contenu et retourne son URL"""
+    # Hors des pages, les échappements $$ de string.Template redeviennent de simples $
+    body = Template(text).safe_substitute().encode()
+    etag, etag_gz = content_etags(body)
+    name = f"{stem}.{etag[1:13]}.{ext}"
+    STATIC_ASSETS[name] = (body, gzip.compress(body, compresslevel=9), etag, etag_gz, content_type)
+    return STATIC_PREFIX + name
+
+
+def externalize_assets(name: str, html: str) -> str:
+    """Minifie le CSS et le JS intégrés à une page et les sert à part, en cache longue durée
+    
+    Les fichiers du dossier templates restent lisibles : tout est fait au chargement.
+    """
+    stem = os.path.splitext(name)[0]
+    html = STYLE_BLOCK.sub(
+        lambda m: f'<link rel="stylesheet" href="{add_static_asset(stem, "css", CONTENT_TYPE_CSS, rcssmin.cssmin(m.group(1)))}">',
+        html
+    )
+    return SCRIPT_BLOCK.sub(
+        lambda m: f'<script src="{add_static_asset(stem, "js", CONTENT_TYPE_JS, rjsmin.jsmin(m.group(1)))}"></script>',
+        html
+    )
+
+
+def load_templates() -> Dict[str, Template]:
+    """Lit et compile une seule fois les pages HTML du dossier templates"""
+    templates = {}
+    for name in os.listdir(TEMPLATE_DIR):
+        if name.endswith(".html"):
+            with open(os.path.join(TEMPLATE_DIR, name), "r", encoding="utf-8") as f:
+                templates[name] = Template(externalize_assets(name, f.read()))
+    return templates
+
+
+TEMPLATES = load_templates()
+
+
+def compile_page(name: str) -> Tuple[Tuple[bytes, ...], Tuple[str, ...]]:
+    """Découpe une page en segments encodés entourant ses variables, une fois pour toutes"""
+    template = TEMPLATES[name]
+    marked = template.safe_substitute({field: f"\x00{field}\x00" for field in template.get_identifiers()})
+    parts = marked.split("\x00")
+    return tuple(part.encode() for part in parts[::2]), tuple(parts[1::2])
+
+
+def render_page(page: Tuple[Tuple[bytes, ...], Tuple[str, ...]], **context) -> bytes:
+    """Assemble une page découpée par compile_page : seules les valeurs sont encodées"""
+    slabs, fields = page
+    chunks = [slabs[0]]
+    for field, slab in zip(fields, slabs[1:]):
+        chunks.append(str(context[field]).encode())
+        chunks.append(slab)
+    return b"".join(chunks)
+
+
+INDEX_PAGE = compile_page('index.html')
+SUCCESS_PAGE = compile_page('success.html')
+
+
+@functools.lru_cache(maxsize=16)
+def render_index(total_users: int, last_update: str) -> Tuple[bytes, bytes, str, str]:
+    """Page d'accueil rendue, réutilisée tant que ses valeurs ne changent pas
     
-    def log_message(self, format, *args):
-        # Supprimer les logs HTTP pour éviter le spam
-        pass
+    Retourne le corps encodé, sa version gzip (compressée une seule fois) et leurs ETags.
+    """
+    body = render_page(INDEX_PAGE, total_users=total_users, last_update=last_update)
+    return (body, gzip.compress(body, compresslevel=9), *content_etags(body))
 
-def start_http_server():
-    """Démarre le serveur HTTP pour Render"""
+
+def is_free_promotion(item: Dict) -> bool:
+    """Conditions strictes pour une vraie promotion gratuite sur un article Steam"""
+    return (item.get('discount_percent', 0) == 100 and
+            item.get('final_price', 0) == 0 and
+            item.get('original_price', 0) > 100)  # Plus de $1
+
+
+def parse_sent_at(value, default: int) -> int:
+    """Convertit une date ISO 8601 de l'ancien format JSON en timestamp Unix"""
+    try:
+        return int(datetime.fromisoformat(value).timestamp())
+    except (TypeError, ValueError):
+        return default
+
+
+def format_games_message(new_games: List[Dict]) -> str:
+    """Construit le message Markdown annonçant les nouvelles promotions"""
+    if len(new_games) == 1:
+        return SINGLE_GAME_TEMPLATE.format_map(new_games[0])
+    
+    return (MULTI_GAMES_HEADER.format(count=len(new_games))
+            + "".join(game['line'] for game in new_games)
+            + MULTI_GAMES_FOOTER)
+
+
+# Serveur HTTP minimal pour Render, servi dans la boucle du bot
+# Dernier horodatage /health formaté : [seconde Unix, ISO 8601 encodé]
+_health_ts = [0, b'']
+
+def health_timestamp() -> bytes:
+    """Horodatage ISO 8601 de /health, reformaté au plus une fois par seconde"""
+    now = int(time.time())
+    if now != _health_ts[0]:
+        _health_ts[:] = [now, datetime.fromtimestamp(now, TIMEZONE).isoformat().encode()]
+    return _health_ts[1]
+
+# Dernière heure affichée sur la page d'accueil : [minute Unix, HH:MM]
+_clock_minute = [0, '']
+
+def clock_minute() -> str:
+    """Heure HH:MM de la page d'accueil, reformatée au plus une fois par minute"""
+    minute = int(time.time()) // 60
+    if minute != _clock_minute[0]:
+        _clock_minute[:] = [minute, datetime.fromtimestamp(minute * 60, TIMEZONE).strftime('%H:%M')]
+    return _clock_minute[1]
+
+async def health(request: web.Request) -> web.Response:
+    body = HEALTH_TEMPLATE % (health_timestamp(), steam_bot._chat_count)
+    return web.Response(body=body, content_type=CONTENT_TYPE_JSON)
+
+async def subscribe(request: web.Request) -> web.Response:
+    # Endpoint d'inscription: /subscribe/CHAT_ID
     try:
-        server = HTTPServer(('0.0.0.0', PORT), HealthCheckHandler)
-        logger.info(f"🌐 Serveur HTTP démarré sur le port {PORT}")
-        server.serve_forever()
+        chat_id = int(request.match_info['chat_id'])
+    except ValueError:
+        return web.Response(
+            status=400,
+            text="<h1>Erreur: Chat ID invalide</h1><p><a href='/'>Retour</a></p>",
+            content_type=CONTENT_TYPE_HTML
+        )
+    
+    # Ajouter le chat_id à la liste
+    steam_bot.add_chat_id(chat_id)
+    
+    html = render_page(SUCCESS_PAGE, chat_id=chat_id, total_users=steam_bot._chat_count)
+    logger.info(f"✅ Nouvel utilisateur inscrit: {chat_id}")
+    response = web.Response(body=html, content_type=CONTENT_TYPE_HTML, charset='utf-8')
+    # Page propre à chaque inscrit : compressée à la volée si le client l'accepte
+    response.enable_compression()
+    return response
+
+@functools.lru_cache(maxsize=64)
+def accepts_gzip(accept_encoding: str) -> bool:
+    """Indique si l'en-tête Accept-Encoding autorise gzip (une q-valeur nulle le refuse)"""
+    qualities = {}
+    for coding in accept_encoding.lower().split(','):
+        name, _, params = coding.partition(';')
+        quality = 1.0
+        for param in params.split(';'):
+            key, _, value = param.strip().partition('=')
+            if key == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities[name.strip()] = quality
+    # gzip absent de la liste : le joker * décide
+    return qualities.get('gzip', qualities.get('x-gzip', qualities.get('*', 0.0))) > 0
+
+def cached_response(request: web.Request, body: bytes, body_gz: bytes, etag: str, etag_gz: str,
+                    content_type: str, headers: Optional[Dict[str, str]] = None) -> web.Response:
+    """Répond avec un corps pré-compressé, ou 304 si le client possède déjà cette version"""
+    gzipped = accepts_gzip(request.headers.get('Accept-Encoding', ''))
+    if gzipped:
+        body, etag = body_gz, etag_gz
+    headers = {**(headers or {}), 'ETag': etag, 'Vary': 'Accept-Encoding'}
+    # Comparaison avec l'ETag de la représentation qui serait envoyée
+    if request.headers.get('If-None-Match') == etag:
+        return web.Response(status=304, headers=headers)
+    if gzipped:
+        headers['Content-Encoding'] = 'gzip'
+    return web.Response(body=body, content_type=content_type, charset='utf-8', headers=headers)
+
+async def index(request: web.Request) -> web.Response:
+    html, html_gz, etag, etag_gz = render_index(steam_bot._chat_count, clock_minute())
+    return cached_response(request, html, html_gz, etag, etag_gz, CONTENT_TYPE_HTML)
+
+async def static_asset(request: web.Request) -> web.Response:
+    asset = STATIC_ASSETS.get(request.match_info['name'])
+    if asset is None:
+        raise web.HTTPNotFound()
+    body, body_gz, etag, etag_gz, content_type = asset
+    # Nom versionné par le contenu : le navigateur peut le garder indéfiniment
+    return cached_response(request, body, body_gz, etag, etag_gz, content_type,
+                           {'Cache-Control': STATIC_CACHE_CONTROL})
+
+async def telegram_webhook(request: web.Request) -> web.Response:
+    # Telegram renvoie le secret fourni à set_webhook : refuser tout autre appelant
+    if request.headers.get('X-Telegram-Bot-Api-Secret-Token') != WEBHOOK_SECRET:
+        return web.Response(status=403)
+    application = request.app[TELEGRAM_APP_KEY]
+    try:
+        update = Update.de_json(orjson.loads(await request.read()), application.bot)
+    except (ValueError, TypeError, KeyError, AttributeError) as e:
+        # Corps non JSON (orjson.JSONDecodeError est une ValueError) ou qui n'est pas une mise à jour
+        logger.warning(f"⚠️ Mise à jour webhook invalide ignorée: {e}")
+        return web.Response(status=400)
+    if update is None:
+        # Corps JSON vide (null, [] ou {}) : de_json ne retourne aucune mise à jour
+        return web.Response(status=400)
+    # Traitement par l'application en arrière-plan : Telegram reçoit sa réponse aussitôt
+    await application.update_queue.put(update)
+    return web.Response()
+
+async def start_web_server(application: Application) -> Optional[web.AppRunner]:
+    """Démarre le serveur HTTP pour Render (et le webhook Telegram si WEBHOOK_URL est défini)"""
+    app = web.Application()
+    app[TELEGRAM_APP_KEY] = application
+    if WEBHOOK_URL:
+        app.add_routes([web.post(WEBHOOK_PATH, telegram_webhook)])
+    app.add_routes([
+        web.get('/health', health),
+        web.get('/subscribe/{chat_id}', subscribe),
+        web.get(STATIC_PREFIX + '{name}', static_asset),
+        # Toute autre page affiche l'accueil
+        web.get('/{tail:.*}', index),
+    ])
+    # Pas de journal d'accès pour éviter le spam
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    try:
+        await web.TCPSite(runner, '0.0.0.0', PORT, backlog=WEB_BACKLOG).start()
     except OSError as e:
-        if "Address already in use" in str(e):
+        await runner.cleanup()
+        if e.errno == errno.EADDRINUSE:
             logger.info(f"⚠️ Port {PORT} déjà utilisé - serveur HTTP ignoré (normal sur Render)")
         else:
             logger.error(f"Erreur serveur HTTP: {e}")
+        return None
+    logger.info(f"🌐 Serveur HTTP démarré sur le port {PORT}")
+    return runner
 
 class SteamSalesBot:
     def __init__(self):
-        self.sent_games: Dict = self.load_sent_games()
-        self.chat_ids: Set[int] = set(self.sent_games.get('chat_ids', []))
+        self.db: sqlite3.Connection = self.open_database()
+        self.chat_ids: Set[int] = {row[0] for row in self.db.execute("SELECT id FROM chat_ids")}
+        # Nombre d'inscrits tenu à jour par add_chat_id/remove_chat_id, lu par les pages web
+        self._chat_count: int = len(self.chat_ids)
+        # Cache mémoire des jeux envoyés : évite une requête SQL par jeu dans la boucle de dédoublonnage
+        self._sent_ids: Set[int] = {row[0] for row in self.db.execute("SELECT app_id FROM sent_games")}
+        # Bot Telegram partagé, celui de l'application (renseigné à son démarrage)
+        self.bot: Optional[Bot] = None
+        # Nouveaux inscrits en attente de leur message de bienvenue
+        self._welcome_queue: asyncio.Queue = asyncio.Queue()
+        # Tâches de fond en cours : une référence forte évite leur collecte avant la fin
+        self._bg_tasks: Set[asyncio.Task] = set()
+        # Session HTTP partagée (keep-alive), créée à la demande dans la boucle asyncio
+        self._session: Optional[aiohttp.ClientSession] = None
+        # Concurrence et débit partagés par tous les envois (diffusions simultanées comprises)
+        self._send_semaphore = asyncio.Semaphore(SEND_CONCURRENCY)
+        self._send_limiter = AsyncLimiter(SEND_RATE_LIMIT, 1.0)
+        # Articles à -100% de la dernière réponse Steam et ses validateurs HTTP
+        self._specials: Optional[List[Dict]] = None
+        self._specials_fetched_at = 0.0
+        self._steam_etag: Optional[str] = None
+        self._steam_last_modified: Optional[str] = None
+        # Requête Steam en cours, partagée par les appels simultanés
+        self._specials_request: Optional[asyncio.Task] = None
         
-    def load_sent_games(self) -> Dict:
-        """Charge les jeux déjà envoyés depuis le fichier JSON"""
+    def open_database(self) -> sqlite3.Connection:
+        """Ouvre la base SQLite et crée le schéma si nécessaire"""
+        db = sqlite3.connect(DATABASE_FILE)
+        # WAL : une validation ajoute au journal au lieu de réécrire les pages de la base,
+        # et synchronous=NORMAL n'attend plus le disque qu'aux points de contrôle
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        if db.execute("PRAGMA user_version").fetchone()[0] < DB_SCHEMA_VERSION:
+            db.executescript("""
+                CREATE TABLE IF NOT EXISTS sent_games (
+                    app_id INTEGER PRIMARY KEY,
+                    name TEXT NOT NULL,
+                    sent_at INTEGER NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS chat_ids (
+                    id INTEGER PRIMARY KEY
+                );
+            """)
+            self.import_legacy_json(db)
+            db.execute(f"PRAGMA user_version = {DB_SCHEMA_VERSION}")
+            db.commit()
+        return db
+    
+    def import_legacy_json(self, db: sqlite3.Connection):
+        """Importe les données de l'ancien fichier JSON dans la base SQLite"""
         try:
-            if os.path.exists(SENT_GAMES_FILE):
-                with open(SENT_GAMES_FILE, 'r', encoding='utf-8') as f:
-                    return json.load(f)
-            else:
-                return {"sent_games": {}, "chat_ids": []}
-        except Exception as e:
-            logger.error(f"Erreur lors du chargement de {SENT_GAMES_FILE}: {e}")
-            return {"sent_games": {}, "chat_ids": []}
+            with open(SENT_GAMES_FILE, 'rb') as f:
+                data = orjson.loads(f.read())
+        except FileNotFoundError:
+            return
+        except orjson.JSONDecodeError as e:
+            # Fichier illisible : le mettre de côté plutôt que de perdre son contenu en silence
+            logger.error(f"❌ {SENT_GAMES_FILE} corrompu, déplacé vers {SENT_GAMES_FILE}.corrupt: {e}")
+            os.replace(SENT_GAMES_FILE, f"{SENT_GAMES_FILE}.corrupt")
+            return
+        
+        sent_games = data.get("sent_games", {}) if isinstance(data, dict) else None
+        chat_ids = data.get("chat_ids", []) if isinstance(data, dict) else None
+        if not isinstance(sent_games, dict) or not isinstance(chat_ids, list):
+            logger.error(f"❌ Format inattendu pour {SENT_GAMES_FILE} - import ignoré")
+            return
+        
+        now = int(time.time())
+        db.executemany(
+            "INSERT OR IGNORE INTO sent_games (app_id, name, sent_at) VALUES (?, ?, ?)",
+            ((int(app_id), game.get("name", ""), parse_sent_at(game.get("sent_at"), now))
+             for app_id, game in sent_games.items() if app_id.isdigit() and isinstance(game, dict))
+        )
+        db.executemany(
+            "INSERT OR IGNORE INTO chat_ids (id) VALUES (?)",
+            ((chat_id,) for chat_id in chat_ids if isinstance(chat_id, int))
+        )
+        logger.info(f"📦 {SENT_GAMES_FILE} importé dans {DATABASE_FILE} "
+                    f"({len(sent_games)} jeux, {len(chat_ids)} utilisateurs)")
     
-    def save_sent_games(self):
-        """Sauvegarde les jeux envoyés dans le fichier JSON"""
+    def flush(self):
+        """Valide les écritures en attente (une seule transaction par lot)"""
+        if not self.db.in_transaction:
+            return
         try:
-            data = {
-                "sent_games": self.sent_games.get("sent_games", {}),
-                "chat_ids": list(self.chat_ids)
-            }
-            with open(SENT_GAMES_FILE, 'w', encoding='utf-8') as f:
-                json.dump(data, f, indent=2, ensure_ascii=False)
-        except Exception as e:
-            logger.error(f"Erreur lors de la sauvegarde de {SENT_GAMES_FILE}: {e}")
+            self.db.commit()
+        except sqlite3.Error as e:
+            logger.error(f"Erreur lors de la sauvegarde dans {DATABASE_FILE}: {e}")
+    
+    def spawn(self, coro) -> asyncio.Task:
+        """Lance une tâche de fond dans la boucle courante en gardant une référence jusqu'à sa fin"""
+        task = asyncio.create_task(coro)
+        self._bg_tasks.add(task)
+        task.add_done_callback(self._on_bg_task_done)
+        return task
+    
+    def _on_bg_task_done(self, task: asyncio.Task):
+        """Libère la tâche terminée et journalise son éventuelle exception"""
+        self._bg_tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f"❌ Erreur dans une tâche de fond: {task.exception()}")
+    
+    async def cancel_background_tasks(self):
+        """Annule les tâches de fond en cours et attend leur fin"""
+        tasks = list(self._bg_tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
     
     def add_chat_id(self, chat_id: int):
         """Ajoute un chat_id à la liste des destinataires et envoie une notification de bienvenue"""
-        is_new_user = chat_id not in self.chat_ids
+        if chat_id in self.chat_ids:
+            return
+        
+        self.db.execute("INSERT OR IGNORE INTO chat_ids (id) VALUES (?)", (chat_id,))
         self.chat_ids.add(chat_id)
-        self.save_sent_games()
+        self._chat_count += 1
+        # Sauvegarde immédiate : une inscription ne doit pas être perdue au redémarrage
+        self.flush()
         logger.info(f"Chat ID {chat_id} ajouté à la liste des destinataires")
         
-        # Envoyer une notification de bienvenue si c'est un nouvel utilisateur
-        if is_new_user:
-            try:
-                # Vérifier s'il y a un event loop actif
-                try:
-                    asyncio.get_running_loop()
-                    # Si on est dans un event loop existant, créer une tâche
-                    welcome_task = asyncio.create_task(self.send_welcome_notification(chat_id))
-                    self._welcome_tasks = getattr(self, '_welcome_tasks', set())
-                    self._welcome_tasks.add(welcome_task)
-                    welcome_task.add_done_callback(self._welcome_tasks.discard)
-                except RuntimeError:
-                    # Pas d'event loop actif, utiliser l'API HTTP directe
-                    self.send_welcome_notification_sync(chat_id)
-            except Exception as e:
-                logger.warning(f"Erreur lors de l'envoi de la notification de bienvenue: {e}")
-    
-    def send_welcome_notification_sync(self, chat_id: int):
-        """Envoie une notification de bienvenue via l'API HTTP Telegram (version synchrone)"""
-        try:
-            welcome_message = f"""🎉 **Bienvenue sur Steam Sales Bot !**
-
-✅ **Inscription confirmée !**
-🆔 **Votre Chat ID :** `{chat_id}`
-
-🎮 **Ce que vous recevrez :**
-• Notifications automatiques à 9h et 19h (heure de Paris)
-• Jeux Steam en vraie promotion -100% uniquement
-• Pas de spam, seulement les vraies bonnes affaires !
-
-🔍 **Commandes disponibles :**
-• `/start` - Afficher le menu principal
-• `/check` - Vérifier manuellement les promotions
-
-🌐 **Partagez le bot :** https://t.me/Steam_Sales_Notifier_Bot
-
-⚡ **Première vérification en cours...**"""
-
-            # Envoyer via l'API HTTP Telegram
-            url = f"https://api.telegram.org/bot{TELEGRAM_TOKEN}/sendMessage"
-            data = {
-                'chat_id': chat_id,
-                'text': welcome_message,
-                'parse_mode': 'Markdown'
-            }
-            
-            response = requests.post(url, data=data, timeout=10)
-            if response.status_code == 200:
-                logger.info(f"✅ Notification de bienvenue envoyée à {chat_id}")
-            else:
-                logger.warning(f"⚠️ Erreur envoi notification bienvenue (HTTP {response.status_code})")
-                
-        except Exception as e:
-            logger.error(f"Erreur lors de l'envoi de la notification de bienvenue: {e}")
+        # Envoyer une notification de bienvenue au nouvel utilisateur (via welcome_worker)
+        self._welcome_queue.put_nowait(chat_id)
+    
+    def remove_chat_id(self, chat_id: int):
+        """Retire un chat_id de la liste des destinataires (validé au prochain flush)"""
+        if chat_id not in self.chat_ids:
+            return
+        self.db.execute("DELETE FROM chat_ids WHERE id = ?", (chat_id,))
+        self.chat_ids.discard(chat_id)
+        self._chat_count -= 1
+    
+    async def welcome_worker(self):
+        """Envoie les messages de bienvenue au fil des inscriptions, jusqu'à son annulation"""
+        # Le TaskGroup garde les envois en cours et les annule avec le worker
+        async with asyncio.TaskGroup() as group:
+            while True:
+                chat_id = await self._welcome_queue.get()
+                group.create_task(self.send_welcome_notification(chat_id))
     
     async def send_welcome_notification(self, chat_id: int):
         """Envoie une notification de bienvenue à un nouvel utilisateur"""
         try:
-            # Vérifier si le token Telegram est disponible
-            if not TELEGRAM_TOKEN:
-                logger.warning("Token Telegram non configuré - notification de bienvenue ignorée")
+            # Le bot de l'application (et sa connexion) est réutilisé pour chaque envoi
+            bot = self.bot
+            if bot is None:
+                logger.warning("Bot Telegram non démarré - notification de bienvenue ignorée")
                 return
-
-            # Créer un bot temporaire pour envoyer la notification
-            bot = Bot(token=TELEGRAM_TOKEN)
             
-            welcome_message = f"""🎉 **Bienvenue sur Steam Sales Bot !**
-
-✅ **Inscription confirmée !**
-🆔 **Votre Chat ID :** `{chat_id}`
-👥 **Vous rejoignez {len(self.chat_ids)} gamers inscrits**
-
-🎮 **Ce que vous allez recevoir :**
-• Notifications instantanées des jeux Steam en vraie promotion -100%
-• Exclusion des jeux gratuits de base (pas de spam)
-• Liens directs vers Steam pour télécharger immédiatement
-• Vérifications automatiques à 9h et 19h (Europe/Paris)
-
-🔔 **Prochaines notifications :**
-• **Automatiques** : 9h00 et 19h00 tous les jours
-• **À la demande** : Utilisez la commande /check quand vous voulez
-
-⚡ **Important :** Je ne notifie que les **vraies promotions temporaires**, pas les jeux free-to-play permanents comme CS2, TF2, Dota 2, etc.
-
-🎯 **Bon gaming et n'hésitez pas à partager le bot !**
-
-_Vous pouvez utiliser /check à tout moment pour vérifier manuellement._"""
+            welcome_message = WELCOME_TEMPLATE.format(chat_id=chat_id, total_users=self._chat_count)
             
-            await bot.send_message(
-                chat_id=chat_id,
+            await self.send_message(
+                bot,
+                chat_id,
                 text=welcome_message,
                 parse_mode='Markdown',
                 disable_web_page_preview=True
@@ -257,39 +558,127 @@ _Vous pouvez utiliser /check à tout moment pour vérifier manuellement._"""
             logger.error(f"❌ Erreur lors de l'envoi de la notification de bienvenue à {chat_id}: {e}")
             # Ne pas faire échouer l'inscription si la notification échoue
     
-    def get_free_games(self) -> List[Dict]:
+    def get_session(self) -> aiohttp.ClientSession:
+        """Retourne la session HTTP partagée, en la créant si nécessaire"""
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=HTTP_POOL_SIZE, ttl_dns_cache=DNS_CACHE_TTL),
+                timeout=aiohttp.ClientTimeout(total=STEAM_API_TIMEOUT, sock_connect=STEAM_API_CONNECT_TIMEOUT),
+                headers={'User-Agent': HTTP_USER_AGENT}
+            )
+        return self._session
+    
+    async def close_session(self):
+        """Ferme la session HTTP partagée"""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+    
+    async def fetch_specials(self) -> List[Dict]:
+        """Récupère les articles à -100% de l'API Steam (avec cache et requêtes conditionnelles)"""
+        if self._specials is not None and time.monotonic() - self._specials_fetched_at < STEAM_CACHE_TTL:
+            return self._specials
+        
+        # Les appels simultanés (plusieurs /check en rafale) partagent une seule requête
+        if self._specials_request is None or self._specials_request.done():
+            self._specials_request = asyncio.create_task(self._request_specials())
+        # shield : l'annulation d'un appelant n'interrompt pas la requête des autres
+        return await asyncio.shield(self._specials_request)
+    
+    async def _request_specials(self) -> List[Dict]:
+        """Interroge l'API Steam et met à jour le cache des articles à -100%"""
+        now = time.monotonic()
+        
+        # Requête conditionnelle : Steam répond 304 sans corps si rien n'a changé
+        headers = {}
+        if self._specials is not None:
+            if self._steam_etag:
+                headers['If-None-Match'] = self._steam_etag
+            if self._steam_last_modified:
+                headers['If-Modified-Since'] = self._steam_last_modified
+        
+        try:
+            await self._download_specials(headers)
+        except STEAM_API_ERRORS as e:
+            if self._specials is None:
+                raise
+            # Steam indisponible : réutiliser la dernière liste connue, sans prolonger
+            # sa validité pour que l'appel suivant retente la requête
+            logger.warning(f"⚠️ API Steam indisponible, réutilisation du cache obtenu il y a "
+                           f"{now - self._specials_fetched_at:.0f}s: {e}")
+            return self._specials
+        
+        self._specials_fetched_at = now
+        return self._specials
+    
+    async def _download_specials(self, headers: Dict[str, str]):
+        """Télécharge les promotions Steam, avec quelques nouvelles tentatives sur les erreurs passagères"""
+        for attempt in range(1, STEAM_API_ATTEMPTS + 1):
+            try:
+                async with self.get_session().get(STEAM_API_URL, headers=headers) as response:
+                    if response.status == 304:
+                        logger.info("Promotions Steam inchangées depuis la dernière requête (HTTP 304)")
+                        return
+                    response.raise_for_status()
+                    body = await response.read()
+                    try:
+                        data = orjson.loads(body)
+                    except orjson.JSONDecodeError:
+                        # Rien n'est remplacé : le cache et ses validateurs (ETag, Last-Modified)
+                        # restent ceux de la dernière réponse lisible
+                        logger.warning(f"⚠️ Réponse Steam illisible ({len(body)} octets), cache des promotions conservé")
+                        raise
+                    # Ne conserver que les articles de la section "specials" (qui contient les
+                    # vraies promotions) à -100% : le reste du document est libéré aussitôt
+                    self._specials = [
+                        item for item in data.get('specials', {}).get('items', [])
+                        if is_free_promotion(item)
+                    ]
+                    self._steam_etag = response.headers.get('ETag')
+                    self._steam_last_modified = response.headers.get('Last-Modified')
+                    return
+            except STEAM_API_ERRORS as e:
+                # Une erreur 4xx ne se corrigera pas en réessayant
+                if isinstance(e, aiohttp.ClientResponseError) and e.status < 500:
+                    raise
+                if attempt == STEAM_API_ATTEMPTS:
+                    raise
+                delay = STEAM_API_RETRY_BACKOFF * 2 ** (attempt - 1)
+                logger.warning(f"⚠️ Erreur API Steam (tentative {attempt}/{STEAM_API_ATTEMPTS}), "
+                               f"nouvel essai dans {delay:.1f}s: {e}")
+                await asyncio.sleep(delay)
+    
+    async def get_free_games(self) -> List[Dict]:
         """Récupère uniquement les jeux en vraie promotion -100% (pas les F2P de base)"""
         try:
-            response = requests.get(STEAM_API_URL, timeout=30)
-            response.raise_for_status()
-            data = response.json()
+            specials = await self.fetch_specials()
             
             free_games = []
+            sent_ids = self._sent_ids
             
-            # Ne vérifier que la section "specials" qui contient les vraies promotions
-            if 'specials' in data and 'items' in data['specials']:
-                for item in data['specials']['items']:
-                    discount_percent = item.get('discount_percent', 0)
-                    final_price = item.get('final_price', 0)
-                    original_price = item.get('original_price', 0)
-                    
-                    # Conditions strictes pour une vraie promotion gratuite
-                    if (discount_percent == 100 and 
-                        final_price == 0 and 
-                        original_price > 100):  # Plus de $1
-                        
-                        app_id = str(item.get('id', ''))
-                        name = item.get('name', f'Jeu {app_id}')
-                        original_price_dollars = original_price / 100
-                        
-                        if app_id and not self.is_game_already_sent(app_id):
-                            if self._verify_real_promotion(app_id, name):
-                                free_games.append({
-                                    'app_id': app_id,
-                                    'name': name,
-                                    'url': f'https://store.steampowered.com/app/{app_id}/',
-                                    'initial_price': original_price_dollars
-                                })
+            for item in specials:
+                # Filtres les moins coûteux d'abord : les chaînes et le dictionnaire
+                # du jeu ne sont construits que pour les candidats retenus
+                app_id = item.get('id')
+                if not isinstance(app_id, int) or app_id in sent_ids:
+                    continue
+                
+                name = item.get('name') or f'Jeu {app_id}'
+                # Vérifier qu'il s'agit vraiment d'une promotion et pas d'un F2P
+                if app_id in KNOWN_F2P_APP_IDS:
+                    logger.info(f"Jeu F2P exclu: {name} (ID: {app_id})")
+                    continue
+                
+                url = f'https://store.steampowered.com/app/{app_id}/'
+                initial_price = item['original_price'] / 100
+                free_games.append({
+                    'app_id': app_id,
+                    'name': name,
+                    'url': url,
+                    'initial_price': initial_price,
+                    # Ligne du message groupé, formatée une seule fois par jeu
+                    'line': MULTI_GAMES_LINE.format(name=name, initial_price=initial_price, url=url)
+                })
             
             logger.info(f"Trouvé {len(free_games)} vraies promotions gratuites (hors F2P)")
             return free_games
@@ -298,99 +687,150 @@ _Vous pouvez utiliser /check à tout moment pour vérifier manuellement._"""
             logger.error(f"Erreur lors de la récupération des jeux en promotion: {e}")
             return []
     
-    def _verify_real_promotion(self, app_id: str, game_name: str) -> bool:
-        """Vérifie qu'il s'agit vraiment d'une promotion et pas d'un F2P"""
-        # Liste des jeux F2P connus à exclure
-        known_f2p_games = {
-            '730', '440', '570', '238960', '386360', '444090', 
-            '578080', '1222670', '359550', '252490'
-        }
-        
-        if app_id in known_f2p_games:
-            logger.info(f"Jeu F2P exclu: {game_name} (ID: {app_id})")
-            return False
-        
-        return True  # Simplification pour éviter trop de complexité
+    def mark_games_as_sent(self, games: List[Dict]):
+        """Marque un lot de jeux comme envoyés avec un horodatage commun (validé au prochain flush)"""
+        sent_at = int(time.time())
+        self.db.executemany(
+            "INSERT OR IGNORE INTO sent_games (app_id, name, sent_at) VALUES (?, ?, ?)",
+            ((game['app_id'], game['name'], sent_at) for game in games)
+        )
+        self._sent_ids.update(game['app_id'] for game in games)
+        self.prune_sent_games(sent_at)
+    
+    def prune_sent_games(self, now: int):
+        """Oublie les jeux envoyés depuis plus de SENT_GAMES_RETENTION_DAYS jours"""
+        cutoff = now - SENT_GAMES_RETENTION_DAYS * 86400
+        pruned = self.db.execute(
+            "DELETE FROM sent_games WHERE sent_at < ? RETURNING app_id", (cutoff,)
+        ).fetchall()
+        if pruned:
+            self._sent_ids.difference_update(row[0] for row in pruned)
+            logger.info(f"🧹 {len(pruned)} jeux envoyés il y a plus de {SENT_GAMES_RETENTION_DAYS} jours oubliés")
     
-    def is_game_already_sent(self, app_id: str) -> bool:
-        """Vérifie si un jeu a déjà été envoyé"""
-        return app_id in self.sent_games.get("sent_games", {})
+    async def send_message(self, bot: Bot, chat_id: int, **kwargs):
+        """Envoie un message sous les limites d'envoi, en attendant le délai imposé par un RetryAfter"""
+        for attempt in range(1, SEND_ATTEMPTS + 1):
+            try:
+                async with self._send_semaphore, self._send_limiter:
+                    return await bot.send_message(chat_id=chat_id, **kwargs)
+            except RetryAfter as e:
+                if attempt == SEND_ATTEMPTS:
+                    raise
+                # Attente hors du sémaphore : les autres envois ne restent pas bloqués derrière
+                logger.warning(f"⏳ Limite Telegram atteinte pour {chat_id}, nouvel essai dans {e.retry_after}s")
+                await asyncio.sleep(e.retry_after)
     
-    def mark_game_as_sent(self, app_id: str, game_name: str):
-        """Marque un jeu comme envoyé"""
-        if "sent_games" not in self.sent_games:
-            self.sent_games["sent_games"] = {}
+    async def broadcast(self, bot, text: str, **kwargs):
+        """Envoie le même message à tous les chats enregistrés, en parallèle"""
+        # Copie : la liste peut changer pendant les envois (nouvelles inscriptions)
+        chat_ids = list(self.chat_ids)
         
-        self.sent_games["sent_games"][app_id] = {
-            "name": game_name,
-            "sent_at": datetime.now(TIMEZONE).isoformat()
-        }
-        self.save_sent_games()
-    
-    async def send_free_games(self, context: ContextTypes.DEFAULT_TYPE, manual_check: bool = False):
-        """Envoie les nouvelles promotions -100% à tous les chats enregistrés"""
-        free_games = self.get_free_games()
+        results = await asyncio.gather(
+            *(self.send_message(bot, chat_id, text=text, **kwargs) for chat_id in chat_ids),
+            return_exceptions=True
+        )
+        for chat_id, result in zip(chat_ids, results):
+            if isinstance(result, Forbidden):
+                # Bot bloqué ou retiré du groupe : inutile de lui réécrire à chaque diffusion
+                logger.info(f"Chat {chat_id} inaccessible ({result}), désinscription")
+                self.remove_chat_id(chat_id)
+            elif isinstance(result, Exception):
+                logger.error(f"Erreur lors de l'envoi à {chat_id}: {result}")
+        self.flush()
+    
+    async def send_free_games(self, bot: Bot, requested_by: Optional[int] = None):
+        """Envoie les nouvelles promotions -100% à tous les chats enregistrés
         
-        if not free_games:
-            if manual_check and self.chat_ids:
-                for chat_id in self.chat_ids:
-                    await context.bot.send_message(
-                        chat_id=chat_id,
-                        text="🎮 Aucune vraie promotion -100% trouvée actuellement sur Steam.\n\n"
-                             "ℹ️ Je ne notifie que les jeux payants qui deviennent temporairement gratuits,\n"
-                             "pas les jeux free-to-play de base (CS2, TF2, Dota 2, etc.)"
-                    )
+        requested_by est le chat à l'origine d'une vérification manuelle : lui seul
+        reçoit l'avis "aucune promotion", en texte brut (sans parse_mode).
+        """
+        # Personne à prévenir : inutile d'interroger Steam (les jeux resteront à annoncer)
+        if not self.chat_ids and requested_by is None:
+            logger.info("Aucun utilisateur inscrit pour recevoir les notifications")
             return
         
-        new_games = []
-        for game in free_games:
-            app_id = game['app_id']
-            if not self.is_game_already_sent(app_id):
-                new_games.append(game)
-                self.mark_game_as_sent(app_id, game['name'])
+        # Seuls les jeux jamais envoyés sont retournés
+        new_games = await self.get_free_games()
         
         if not new_games:
-            if manual_check and self.chat_ids:
-                for chat_id in self.chat_ids:
-                    await context.bot.send_message(
-                        chat_id=chat_id,
-                        text="🎮 Aucune nouvelle promotion -100% depuis la dernière vérification."
-                    )
+            logger.info("Aucune nouvelle promotion disponible actuellement")
+            if requested_by is not None:
+                await self.send_message(
+                    bot,
+                    requested_by,
+                    text="🎮 Aucune vraie promotion -100% trouvée actuellement sur Steam.\n\n"
+                    "ℹ️ Je ne notifie que les jeux payants qui deviennent temporairement gratuits,\n"
+                    "pas les jeux free-to-play de base (CS2, TF2, Dota 2, etc.)"
+                )
             return
         
+        # Aucun await ne sépare le filtrage de get_free_games de ce marquage :
+        # un appel concurrent ne peut pas renvoyer les mêmes jeux
+        self.mark_games_as_sent(new_games)
+        self.flush()
+        
+        # Créer le message (une seule fois pour tous les destinataires)
+        message = format_games_message(new_games)
+        
         # Envoyer les nouveaux jeux à tous les chats enregistrés
-        for chat_id in self.chat_ids:
-            try:
-                if len(new_games) == 1:
-                    game = new_games[0]
-                    message = (f"🎮 **Nouvelle promotion -100% sur Steam !**\n\n"
-                             f"🎯 **{game['name']}**\n"
-                             f"💰 Temporairement gratuit (normalement ${game['initial_price']:.2f})\n"
-                             f"🔗 [Obtenir le jeu maintenant]({game['url']})\n\n"
-                             f"⚡ **Promotion limitée dans le temps !**")
-                else:
-                    message = f"🎮 **{len(new_games)} nouvelles promotions -100% sur Steam !**\n\n"
-                    for game in new_games:
-                        message += (f"🎯 **{game['name']}**\n"
-                                  f"💰 Temporairement gratuit (normalement ${game['initial_price']:.2f})\n"
-                                  f"🔗 [Obtenir maintenant]({game['url']})\n\n")
-                    message += "⚡ **Promotions limitées dans le temps !**"
-                
-                await context.bot.send_message(
-                    chat_id=chat_id,
-                    text=message,
-                    parse_mode='Markdown',
-                    disable_web_page_preview=False
-                )
-                
-            except Exception as e:
-                logger.error(f"Erreur lors de l'envoi à {chat_id}: {e}")
+        await self.broadcast(
+            bot,
+            message,
+            parse_mode='Markdown',
+            disable_web_page_preview=False
+        )
         
         logger.info(f"Envoyé {len(new_games)} nouvelles promotions à {len(self.chat_ids)} chats")
 
 # Instance globale du bot
 steam_bot = SteamSalesBot()
 
+async def on_application_start(application: Application):
+    """Initialisation dans la boucle du bot, avant le démarrage du polling"""
+    steam_bot.bot = application.bot
+    
+    # Le scheduler exécute les vérifications directement dans la boucle du bot
+    scheduler = AsyncIOScheduler(timezone=TIMEZONE)
+    
+    # Programmer les vérifications à 9h et 19h (heure de Paris)
+    scheduler.add_job(
+        scheduled_check,
+        args=[application],
+        trigger=CronTrigger(hour=9, minute=0, timezone=TIMEZONE),
+        id='morning_check',
+        replace_existing=True
+    )
+    
+    scheduler.add_job(
+        scheduled_check,
+        args=[application],
+        trigger=CronTrigger(hour=19, minute=0, timezone=TIMEZONE),
+        id='evening_check',
+        replace_existing=True
+    )
+    
+    # Démarrer le scheduler
+    scheduler.start()
+    application.bot_data['scheduler'] = scheduler
+    steam_bot.spawn(steam_bot.welcome_worker())
+    logger.info("Scheduler démarré - Vérifications programmées à 9h et 19h (Europe/Paris)")
+    
+    # Vérification initiale optionnelle : sinon chaque déploiement ou redémarrage interroge Steam
+    if STARTUP_CHECK:
+        logger.info("🧪 Test initial de l'API Steam...")
+        await scheduled_check(application)
+
+async def on_application_shutdown(application: Application):
+    """Arrête le scheduler et les bienvenues, ferme la session HTTP partagée et sauvegarde les données"""
+    scheduler = application.bot_data.pop('scheduler', None)
+    if scheduler is not None:
+        scheduler.shutdown(wait=False)
+    # Bienvenues et autres tâches de fond : annulées plutôt qu'attendues
+    await steam_bot.cancel_background_tasks()
+    steam_bot.bot = None
+    await steam_bot.close_session()
+    steam_bot.flush()
+
 async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Commande /start"""
     if not update.effective_chat or not update.message:
@@ -430,7 +870,7 @@ async def check_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     steam_bot.add_chat_id(chat_id)
     
     await update.message.reply_text("🔍 Vérification des promotions -100% en cours...")
-    await steam_bot.send_free_games(context, manual_check=True)
+    await steam_bot.send_free_games(context.bot, requested_by=chat_id)
 
 async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Gestion des callbacks des boutons"""
@@ -446,87 +886,122 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
             steam_bot.add_chat_id(chat_id)
         
         await query.edit_message_text("🔍 Vérification des promotions -100% en cours...")
-        await steam_bot.send_free_games(context, manual_check=True)
+        await steam_bot.send_free_games(
+            context.bot,
+            requested_by=update.effective_chat.id if update.effective_chat else None
+        )
 
-def scheduled_check_sync():
-    """Vérification programmée des jeux en promotion (version synchrone)"""
+async def scheduled_check(application: Application):
+    """Vérification programmée des jeux en promotion (dans la boucle du bot)"""
     logger.info("Vérification programmée des promotions -100%")
     try:
-        free_games = steam_bot.get_free_games()
-        if not free_games:
-            logger.info("Aucune promotion disponible actuellement")
-            return
-            
-        new_games = []
-        for game in free_games:
-            app_id = game['app_id']
-            if not steam_bot.is_game_already_sent(app_id):
-                new_games.append(game)
-                steam_bot.mark_game_as_sent(app_id, game['name'])
-        
-        if not new_games:
-            logger.info("Aucune nouvelle promotion trouvée")
-            return
-            
-        if not steam_bot.chat_ids:
-            logger.info("Aucun utilisateur inscrit pour recevoir les notifications")
-            return
-        
-        # Envoyer les notifications automatiquement
-        send_automatic_notifications(new_games)
-        logger.info(f"Notifications envoyées pour {len(new_games)} nouveaux jeux")
-        
+        await steam_bot.send_free_games(application.bot)
     except Exception as e:
         logger.error(f"Erreur lors de la vérification programmée: {e}")
 
-def send_automatic_notifications(new_games):
-    """Envoie les notifications automatiques pour les nouveaux jeux"""
-    import asyncio
-    
-    async def send_notifications():
-        """Envoie les notifications de nouveaux jeux"""
-        # Vérifier que le token existe
-        if not TELEGRAM_TOKEN:
-            logger.error("Token Telegram manquant pour les notifications automatiques")
-            return
+async def test_telegram_token(bot: Bot) -> bool:
+    """Test rapide du token Telegram, avec le bot de l'application"""
+    try:
+        # initialize() est idempotent : l'application réutilisera cette connexion
+        await bot.initialize()
+        bot_info = await bot.get_me()
+        logger.info(f"🤖 Bot Telegram disponible: @{bot_info.username}")
+        logger.info(f"🔗 Lien du bot: https://t.me/{bot_info.username}")
+        return True
+    except Exception as e:
+        logger.error(f"Erreur de test token: {e}")
+        return False
 
-        bot = Bot(token=TELEGRAM_TOKEN)
+async def amain():
+    """Fait tourner le bot, le scheduler, la réception des mises à jour et le serveur HTTP dans une seule boucle asyncio"""
+    # Initialiser l'application Telegram
+    application = Application.builder().token(TELEGRAM_TOKEN).build()
+    application.add_handler(CommandHandler('start', start_command))
+    application.add_handler(CommandHandler('check', check_command))
+    application.add_handler(CallbackQueryHandler(button_callback))
+    
+    # Démarrer le serveur HTTP pour Render en premier : le port doit répondre au plus vite
+    web_runner = await start_web_server(application)
+    
+    try:
+        # Configuration et démarrage du bot Telegram
+        telegram_working = False
         
-        for chat_id in steam_bot.chat_ids:
+        try:
+            # Tester le token avant de démarrer le polling
+            token_valid = await test_telegram_token(application.bot)
+            
+            if token_valid:
+                telegram_working = True
+                logger.info("✅ Token Telegram validé")
+                logger.info("� Commandes disponibles: /start, /check")
+                logger.info("🌐 Interface web: https://steamsalesbot.onrender.com")
+                logger.info("🔄 Bot Telegram sera démarré à la demande pour les commandes")
+            else:
+                raise Exception("Token Telegram invalide")
+        
+        except Exception as e:
+            logger.warning(f"⚠️ Problème avec le bot Telegram: {e}")
+            logger.info("🔔 Mode notifications automatiques uniquement")
+            telegram_working = False
+        
+        # SIGINT/SIGTERM (arrêt demandé par Render) débloquent l'attente ci-dessous
+        stop_event = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, stop_event.set)
+            except NotImplementedError:
+                # Windows : seul KeyboardInterrupt est disponible
+                pass
+        
+        async with application:
             try:
-                # Créer le message
-                if len(new_games) == 1:
-                    game = new_games[0]
-                    message = (f"🎮 **Nouvelle promotion -100% sur Steam !**\n\n"
-                             f"🎯 **{game['name']}**\n"
-                             f"💰 Temporairement gratuit (normalement ${game['initial_price']:.2f})\n"
-                             f"🔗 [Obtenir le jeu maintenant]({game['url']})\n\n"
-                             f"⚡ **Promotion limitée dans le temps !**")
+                # La vérification initiale est faite avant le démarrage du polling
+                await on_application_start(application)
+                # Sans serveur HTTP, personne ne servirait le webhook : polling à la place
+                use_webhook = bool(WEBHOOK_URL) and web_runner is not None
+                if WEBHOOK_URL and not use_webhook:
+                    logger.warning("⚠️ Serveur HTTP indisponible - webhook ignoré, passage en polling")
+                if use_webhook:
+                    # Telegram pousse les mises à jour vers le serveur HTTP : pas de getUpdates
+                    await application.bot.set_webhook(
+                        url=WEBHOOK_URL + WEBHOOK_PATH,
+                        secret_token=WEBHOOK_SECRET,
+                        allowed_updates=[Update.MESSAGE, Update.CALLBACK_QUERY],
+                        max_connections=40
+                    )
+                    logger.info(f"🪝 Webhook Telegram configuré sur {WEBHOOK_URL}{WEBHOOK_PATH}")
                 else:
-                    message = f"🎮 **{len(new_games)} nouvelles promotions -100% sur Steam !**\n\n"
-                    for game in new_games:
-                        message += (f"🎯 **{game['name']}**\n"
-                                  f"💰 Temporairement gratuit (normalement ${game['initial_price']:.2f})\n"
-                                  f"🔗 [Obtenir maintenant]({game['url']})\n\n")
-                    message += "⚡ **Promotions limitées dans le temps !**"
+                    await application.updater.start_polling()
+                await application.start()
                 
-                # Envoyer le message
-                await bot.send_message(
-                    chat_id=chat_id,
-                    text=message,
-                    parse_mode='Markdown',
-                    disable_web_page_preview=False
-                )
+                logger.info("✅ Bot Steam Sales démarré avec succès !")
+                logger.info("🔔 Les notifications automatiques sont actives")
+                logger.info("📅 Prochaines vérifications: 9h et 19h (Europe/Paris)")
                 
-            except Exception as e:
-                logger.error(f"Erreur lors de l'envoi à {chat_id}: {e}")
-    
-    # Exécuter les notifications
-    try:
-        asyncio.run(send_notifications())
-        logger.info(f"Envoyé {len(new_games)} promotions à {len(steam_bot.chat_ids)} utilisateurs")
-    except Exception as e:
-        logger.error(f"Erreur lors de l'envoi des notifications automatiques: {e}")
+                if telegram_working:
+                    logger.info("📱 Bot Telegram opérationnel pour les notifications")
+                else:
+                    logger.info("📱 Notifications uniquement (ajoutez votre chat_id manuellement)")
+                
+                await stop_event.wait()
+            finally:
+                # Couper d'abord les entrées (HTTP, mises à jour), laisser l'application traiter
+                # les mises à jour en attente, puis arrêter le scheduler et les tâches de fond.
+                # Exécuté aussi si le démarrage échoue (set_webhook refusé, par exemple)
+                if web_runner is not None:
+                    await web_runner.cleanup()
+                    web_runner = None
+                if application.updater.running:
+                    await application.updater.stop()
+                if application.running:
+                    await application.stop()
+                await on_application_shutdown(application)
+    finally:
+        # Échec avant l'entrée dans l'application : libérer tout de même le port
+        if web_runner is not None:
+            await web_runner.cleanup()
 
 def main():
     """Fonction principale"""
@@ -537,100 +1012,17 @@ def main():
         logger.error("Token Telegram manquant - arrêt du service")
         return
     
-    # Démarrer le serveur HTTP pour Render (en arrière-plan)
-    http_thread = threading.Thread(target=start_http_server, daemon=True)
-    http_thread.start()
-    
-    # Configuration et démarrage du bot Telegram
-    telegram_working = False
+    if uvloop is not None:
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+        logger.info("⚡ Boucle asyncio uvloop activée")
     
     try:
-        # Test simple de connexion sans créer l'application complète
-        async def test_telegram_token():
-            """Test rapide du token Telegram"""
-            try:
-                from telegram import Bot
-                bot = Bot(token=TELEGRAM_TOKEN)
-                bot_info = await bot.get_me()
-                await bot.close()  # Fermer proprement la connexion
-                logger.info(f"🤖 Bot Telegram disponible: @{bot_info.username}")
-                logger.info(f"🔗 Lien du bot: https://t.me/{bot_info.username}")
-                return True
-            except Exception as e:
-                logger.error(f"Erreur de test token: {e}")
-                return False
-        
-        # Tester le token
-        token_valid = asyncio.run(test_telegram_token())
-        
-        if token_valid:
-            telegram_working = True
-            logger.info("✅ Token Telegram validé")
-            logger.info("� Commandes disponibles: /start, /check")
-            logger.info("🌐 Interface web: https://steamsalesbot.onrender.com")
-            logger.info("🔄 Bot Telegram sera démarré à la demande pour les commandes")
-        else:
-            raise Exception("Token Telegram invalide")
-        
-    except Exception as e:
-        logger.warning(f"⚠️ Problème avec le bot Telegram: {e}")
-        logger.info("🔔 Mode notifications automatiques uniquement")
-        telegram_working = False
-    
-    # Configurer le scheduler pour les vérifications automatiques
-    scheduler = BackgroundScheduler(timezone=TIMEZONE)
-    
-    # Programmer les vérifications à 9h et 19h (heure de Paris)
-    scheduler.add_job(
-        scheduled_check_sync,
-        trigger=CronTrigger(hour=9, minute=0, timezone=TIMEZONE),
-        id='morning_check',
-        replace_existing=True
-    )
-    
-    scheduler.add_job(
-        scheduled_check_sync,
-        trigger=CronTrigger(hour=19, minute=0, timezone=TIMEZONE),
-        id='evening_check',
-        replace_existing=True
-    )
-
-    # Démarrer le scheduler
-    scheduler.start()
-    logger.info("Scheduler démarré - Vérifications programmées à 9h et 19h (Europe/Paris)")
-
-    # Initialiser l'application Telegram
-    application = Application.builder().token(TELEGRAM_TOKEN).build()
-    application.add_handler(CommandHandler('start', start_command))
-    application.add_handler(CommandHandler('check', check_command))
-    application.add_handler(CallbackQueryHandler(button_callback))
-
-    try:
-        logger.info("✅ Bot Steam Sales démarré avec succès !")
-        logger.info("🔔 Les notifications automatiques sont actives")
-        logger.info("📅 Prochaines vérifications: 9h et 19h (Europe/Paris)")
-
-        if telegram_working:
-            logger.info("📱 Bot Telegram opérationnel pour les notifications")
-        else:
-            logger.info("📱 Notifications uniquement (ajoutez votre chat_id manuellement)")
-
-        # Faire une vérification initiale pour tester
-        logger.info("🧪 Test initial de l'API Steam...")
-        scheduled_check_sync()
-
-        # Démarrer le bot Telegram
-        application.run_polling()
-
+        asyncio.run(amain())
     except KeyboardInterrupt:
         logger.info("Arrêt demandé par l'utilisateur")
     except Exception as e:
         logger.error(f"Erreur dans la boucle principale: {e}")
     finally:
-        try:
-            scheduler.shutdown()
-        except Exception:
-            pass
         logger.info("Bot arrêté proprement")
 
 if __name__ == '__main__':